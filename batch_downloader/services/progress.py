@@ -3,11 +3,21 @@ from typing import Dict, Any
 
 # Temporarily disable EventStream until we fix the configuration
 # from django_eventstream import send_event
+from django.core.cache import cache
 from django.db.models import F, Sum
+from django.utils import timezone
 
 from ..models import DownloadJob, ProductBatch, ImageItem
 
 
+# How long a job's progress version is kept after its last update
+PROGRESS_VERSION_TIMEOUT = 60 * 60
+
+# SSE streams re-read the DB after this many polls without a version change,
+# for jobs running in processes that don't share this cache
+SSE_RESYNC_TICKS = 10
+
+
 class ProgressService:
     """Service for emitting real-time progress updates via Server-Sent Events"""
     
@@ -21,7 +31,27 @@ class ProgressService:
         #     **(data or {})
         # }
         # send_event(f'job-{job_id}', 'job_update', event_data)
-        pass
+        self.bump_job_version(job_id)
+    
+    def bump_job_version(self, job_id: str):
+        """Signal SSE streams that a job's progress has changed"""
+        key = self._version_key(job_id)
+        try:
+            cache.incr(key)
+            cache.touch(key, PROGRESS_VERSION_TIMEOUT)  # incr doesn't extend the TTL
+        except ValueError:
+            cache.set(key, 1, PROGRESS_VERSION_TIMEOUT)
+    
+    def get_job_version(self, job_id: str):
+        """Current progress version for a job, or None if this cache has not seen it"""
+        return cache.get(self._version_key(job_id))
+    
+    async def aget_job_version(self, job_id: str):
+        """Async variant of get_job_version"""
+        return await cache.aget(self._version_key(job_id))
+    
+    def _version_key(self, job_id: str) -> str:
+        return f'job-progress-version:{job_id}'
     
     def emit_product_progress(self, product_batch_id: int, event_type: str, data: Dict[str, Any] = None):
         """Emit progress event for a product batch"""
@@ -178,7 +208,6 @@ class ProgressService:
     
     def _get_timestamp(self) -> str:
         """Get current timestamp in ISO format"""
-        from django.utils import timezone
         return timezone.now().isoformat()
 
 
@@ -1,15 +1,43 @@
 import os
 import hashlib
 import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from urllib.parse import urlparse, unquote
 from typing import Tuple
 import time
 
 import requests
 from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Value, When
 from slugify import slugify
 
-from ..models import ImageItem
+from ..models import DownloadJob, ProductBatch, ImageItem
+from .progress import progress_service
+from .zip_service import zip_service
+
+
+# HTTP statuses worth retrying; anything else fails the image immediately
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Download results are written to the counters in batches of this size
+PROGRESS_FLUSH_EVERY = 8
+
+# Final product status derived from its download counters
+PRODUCT_STATUS_FROM_COUNTS = Case(
+    When(downloaded_count__gte=F('image_count'), then=Value('COMPLETED')),
+    When(downloaded_count__gt=0, then=Value('PARTIAL')),
+    default=Value('FAILED'),
+)
+
+# Set when the process is exiting; running jobs pause at their next status check
+_shutdown = threading.Event()
+
+
+def request_shutdown():
+    """Ask jobs in this process to stop so the interpreter can exit"""
+    _shutdown.set()
 
 
 class SimpleDownloadService:
@@ -18,6 +46,8 @@ class SimpleDownloadService:
     def __init__(self):
         self.max_size = 50 * 1024 * 1024  # 50MB limit
         self.timeout = 30  # 30 seconds timeout
+        self.max_retries = 3
+        self.max_workers = getattr(settings, 'DOWNLOAD_WORKERS', 8)  # Parallel downloads per product
         self._current_job_id = None
         
     def set_job_id(self, job_id: str):
@@ -38,17 +68,17 @@ class SimpleDownloadService:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.get(url, headers=headers, timeout=self.timeout, stream=True)
-            response.raise_for_status()
+            response = self._get_with_retries(url, headers)
             
             # Check content type
             content_type = response.headers.get('content-type', '').split(';')[0].lower()
             if content_type and not content_type.startswith('image/'):
                 return False, f"Invalid content type: {content_type}"
             
-            # Generate filename
+            # Generate filename; the on-disk name is prefixed with the image id so
+            # URLs sharing a basename never write to the same file concurrently
             filename = self._generate_filename(url, content_type)
-            file_path = self._get_file_path(image_item.product_batch.product_number, filename)
+            file_path = self._get_file_path(image_item.product_batch.product_number, f"{image_item.pk}_{filename}")
             
             # Ensure directory exists
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -100,6 +130,30 @@ class SimpleDownloadService:
             image_item.save()
             return False, f"Unexpected error: {str(e)}"
     
+    def _download_in_thread(self, image_item: ImageItem) -> Tuple[bool, str]:
+        """Download an image on a pool thread, releasing its DB connection afterwards"""
+        try:
+            return self.download_image(image_item)
+        finally:
+            close_old_connections()
+    
+    def _get_with_retries(self, url: str, headers: dict) -> requests.Response:
+        """GET a URL, retrying transient failures with exponential backoff"""
+        for attempt in range(self.max_retries):
+            try:
+                response = requests.get(url, headers=headers, timeout=self.timeout, stream=True)
+                if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries - 1:
+                    response.close()
+                    time.sleep(2 ** attempt)  # Exponential backoff
+                    continue
+                response.raise_for_status()
+                return response
+                
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(2 ** attempt)
+    
     def _generate_filename(self, url: str, content_type: str) -> str:
         """Generate a safe filename from URL and content type"""
         parsed = urlparse(url)
@@ -142,83 +196,161 @@ class SimpleDownloadService:
                 filename
             )
     
+    def _iter_completed(self, futures: dict):
+        """Yield (image_item, result) as downloads finish, removing each from ``futures``"""
+        for future in as_completed(list(futures)):
+            yield futures.pop(future), future.result()
+    
+    def _drain_downloads(self, futures: dict):
+        """Cancel queued downloads and return the results of those that still ran"""
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        return [
+            (image_item, future.result()) for future, image_item in futures.items()
+            if not future.cancelled() and future.exception() is None
+        ]
+    
+    def _stop_requested(self, job) -> bool:
+        """Refresh the job status and report whether processing should stop"""
+        if _shutdown.is_set():
+            # Leave the job resumable instead of RUNNING with no thread behind it
+            if DownloadJob.objects.filter(pk=job.pk, status='RUNNING').update(status='PAUSED'):
+                progress_service.emit_job_progress(job.id, 'job.status_changed')
+        job.refresh_from_db(fields=['status'])
+        return job.status in ['PAUSED', 'CANCELLED']
+    
+    def _record_result(self, counts: dict, image_item: ImageItem, success: bool, retried: bool = False):
+        """Add one download result to the pending counter batch"""
+        if retried:
+            # A retried FAILED image was already counted as failed once
+            counts['retried'] += 1
+        if success:
+            counts['downloaded'] += 1
+            counts['size_bytes'] += image_item.size_bytes
+        else:
+            counts['failed'] += 1
+    
+    def _flush_progress(self, job, product, counts: dict):
+        """Add a batch of download results to the product and job counters"""
+        if not counts['downloaded'] and not counts['failed']:
+            return
+        
+        # Increment counters in SQL so no refresh/save cycle is needed
+        failed = counts['failed'] - counts['retried']
+        ProductBatch.objects.filter(pk=product.pk).update(
+            downloaded_count=F('downloaded_count') + counts['downloaded'],
+            failed_count=F('failed_count') + failed,
+            bytes_downloaded=F('bytes_downloaded') + counts['size_bytes']
+        )
+        DownloadJob.objects.filter(pk=job.pk).update(
+            completed_images=F('completed_images') + counts['downloaded'],
+            failed_images=F('failed_images') + failed
+        )
+        counts.update(downloaded=0, failed=0, retried=0, size_bytes=0)
+        progress_service.emit_job_progress(job.id, 'images.completed')
+    
     def process_job(self, job):
         """Process a complete job, handling pause/resume functionality"""
-        from ..models import ProductBatch
-        
+        executor = None
         try:
-            # Check initial job status - don't override PAUSED or CANCELLED
-            if job.status not in ['PAUSED', 'CANCELLED']:
-                job.status = 'RUNNING'
-                job.save()
+            # A job queued behind the shutdown stays PENDING for the next process
+            if _shutdown.is_set():
+                print(f"Shutting down, not starting job {job.id}")
+                return
+            
+            # Start with a conditional UPDATE: the instance may have waited in the
+            # job queue, so a pause or cancel made meanwhile must not be undone
+            started = DownloadJob.objects.filter(
+                pk=job.pk,
+                status__in=['PENDING', 'RUNNING']
+            ).update(status='RUNNING')
+            if not started:
+                job.refresh_from_db(fields=['status'])
+                print(f"Job {job.id} is {job.status.lower()}, not starting")
+                return
+            job.status = 'RUNNING'
+            progress_service.emit_job_progress(job.id, 'job.status_changed')
             
             self.set_job_id(str(job.id))
             
             # Get all products for this job, ordered by product_number
             products = ProductBatch.objects.filter(job=job).order_by('product_number')
             
+            # One download pool serves every product of this job
+            if self.max_workers > 1:
+                executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='download')
+            
             for product in products:
                 # Check if job was paused or cancelled
-                job.refresh_from_db()
-                if job.status in ['PAUSED', 'CANCELLED']:
+                if self._stop_requested(job):
                     print(f"Job {job.id} was {job.status.lower()}, stopping processing")
                     return  # Exit early instead of break to avoid status update
                 
-                # Process images for this product
-                images = product.images.filter(status__in=['PENDING', 'FAILED'])
+                # Download this product's images, in parallel when enabled. Pool
+                # threads pull the next image only once they are free, so one
+                # slow host can't hold queued images hostage
+                images = list(product.images.filter(status__in=['PENDING', 'FAILED']))
+                retried = {image_item.pk for image_item in images if image_item.status == 'FAILED'}
+                unread = {}
+                if executor:
+                    unread = {executor.submit(self._download_in_thread, image_item): image_item for image_item in images}
+                    results = self._iter_completed(unread)
+                else:
+                    results = ((image_item, self.download_image(image_item)) for image_item in images)
                 
-                for image_item in images:
-                    # Check pause/cancel status again
-                    job.refresh_from_db()
-                    if job.status in ['PAUSED', 'CANCELLED']:
-                        print(f"Job {job.id} was {job.status.lower()}, stopping processing")
-                        return
-                    
-                    # Download the image
-                    success, message = self.download_image(image_item)
-                    if success:
-                        product.downloaded_count += 1
-                        product.bytes_downloaded += image_item.size_bytes
-                        job.completed_images += 1
-                    else:
-                        job.failed_images += 1
-                    
-                    # Save progress (don't try to set progress_percentage as it's a property)
-                    product.save()
-                    job.save()
-                    
-                    # Small delay to allow pause checks
-                    time.sleep(0.1)
+                counts = {'downloaded': 0, 'failed': 0, 'retried': 0, 'size_bytes': 0}
+                try:
+                    for image_item, (success, message) in results:
+                        self._record_result(counts, image_item, success, image_item.pk in retried)
+                        
+                        # Write counters back in batches rather than per image
+                        if counts['downloaded'] + counts['failed'] >= PROGRESS_FLUSH_EVERY:
+                            self._flush_progress(job, product, counts)
+                        
+                        # Check pause/cancel status after every image; queued downloads are dropped
+                        if self._stop_requested(job):
+                            print(f"Job {job.id} was {job.status.lower()}, stopping processing")
+                            return
+                finally:
+                    # Downloads already running when we stop still save their
+                    # image, so their results have to be counted too
+                    for image_item, (success, message) in self._drain_downloads(unread):
+                        self._record_result(counts, image_item, success, image_item.pk in retried)
+                    self._flush_progress(job, product, counts)
                 
-                # Update product status
-                if product.downloaded_count >= product.image_count:
-                    product.status = 'COMPLETED'
-                elif product.downloaded_count > 0:
-                    product.status = 'PARTIAL'
-                else:
-                    product.status = 'FAILED'
-                product.save()
+                # Update product status in SQL from its counters
+                ProductBatch.objects.filter(pk=product.pk).update(status=PRODUCT_STATUS_FROM_COUNTS)
                 
-                # Update ZIP status for completed/partial products
-                if product.status in ['COMPLETED', 'PARTIAL']:
-                    from .zip_service import zip_service
-                    zip_service.update_product_zip_status(product)
-            
-            # Update final job status
-            job.refresh_from_db()
-            if job.status == 'RUNNING':  # Only update if still running (not paused)
-                if job.completed_images >= job.total_images:
-                    job.status = 'COMPLETED'
-                elif job.completed_images > 0:
-                    job.status = 'COMPLETED'  # Consider partial downloads as completed
-                else:
-                    job.status = 'FAILED'
-                job.save()
+                # Build the ZIP if anything was downloaded (clears zip_ready otherwise)
+                zip_service.update_product_zip_status(product)
+                progress_service.emit_job_progress(job.id, 'product.completed')
+            
+            # Update final job status; the row is locked only for this transition
+            with transaction.atomic():
+                locked = DownloadJob.objects.select_for_update(skip_locked=True).filter(pk=job.pk).first()
+                if locked is None:
+                    return  # Another worker is transitioning this job
+                if locked.status == 'RUNNING':  # Only update if still running (not paused)
+                    if locked.completed_images >= locked.total_images:
+                        locked.status = 'COMPLETED'
+                    elif locked.completed_images > 0:
+                        locked.status = 'COMPLETED'  # Consider partial downloads as completed
+                    else:
+                        locked.status = 'FAILED'
+                    locked.save(update_fields=['status'])
+                    transaction.on_commit(lambda: progress_service.emit_job_progress(job.id, 'job.status_changed'))
+                job.status = locked.status
                 
         except Exception as e:
             print(f"Error processing job {job.id}: {e}")
             job.status = 'FAILED'
-            job.save()
+            job.save(update_fields=['status'])
+            progress_service.emit_job_progress(job.id, 'job.status_changed')
+        
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
 
 
 # Global instance
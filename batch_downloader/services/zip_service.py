@@ -7,6 +7,7 @@ from io import BytesIO
 from django.conf import settings
 from django.http import StreamingHttpResponse, HttpResponse
 from django.core.files.storage import default_storage
+from zipstream import ZipStream
 
 from ..models import ProductBatch, ImageItem
 
@@ -14,42 +15,47 @@ from ..models import ProductBatch, ImageItem
 class ZipService:
     """Service for creating and streaming ZIP files"""
     
-    def stream_product_zip(self, product_batch: ProductBatch) -> HttpResponse:
-        """Create a ZIP file for a single product"""
-        # Create in-memory ZIP with optimized compression
-        buffer = BytesIO()
+    def stream_product_zip(self, product_batch: ProductBatch) -> StreamingHttpResponse:
+        """Stream a ZIP file for a single product, generated on the fly"""
         compression_level = getattr(settings, 'ZIP_COMPRESSION_LEVEL', 1)
         
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=compression_level) as zf:
-            # Get all completed images for this product
-            images = ImageItem.objects.filter(
-                product_batch=product_batch,
-                status='DONE'
-            ).exclude(file_path='')
-            
-            # Track used filenames to avoid duplicates
-            used_names = set()
-            
-            for image in images:
-                if self._file_exists(image.file_path):
-                    # Generate unique archive name
-                    archive_name = self._get_unique_archive_name(image.filename, used_names)
-                    used_names.add(archive_name)
-                    
-                    if settings.MEDIA_BACKEND == 's3':
-                        # For S3, read the file content
-                        with default_storage.open(image.file_path, 'rb') as f:
-                            zf.writestr(archive_name, f.read())
-                    else:
-                        # For local files, add directly
-                        zf.write(image.file_path, archive_name)
+        # Stored archives of local files have a known size up front, which
+        # lets us send Content-Length so browsers can show progress
+        stored = compression_level == 0
+        zs = ZipStream(
+            compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED,
+            compress_level=None if stored else compression_level,
+            sized=stored and settings.MEDIA_BACKEND != 's3',
+        )
         
-        buffer.seek(0)
+        # Get all completed images for this product
+        images = ImageItem.objects.filter(
+            product_batch=product_batch,
+            status='DONE'
+        ).exclude(file_path='')
+        
+        # Track used filenames to avoid duplicates
+        used_names = set()
+        
+        for image in images:
+            if self._file_exists(image.file_path):
+                # Generate unique archive name
+                archive_name = self._get_unique_archive_name(image.filename, used_names)
+                used_names.add(archive_name)
+                
+                if settings.MEDIA_BACKEND == 's3':
+                    # For S3, stream the file content in chunks
+                    zs.add(self._iter_storage_file(image.file_path), archive_name)
+                else:
+                    # For local files, add directly
+                    zs.add_path(image.file_path, archive_name)
         
         # Create response with proper filename
         filename = f"{product_batch.product_number}.zip"
-        response = HttpResponse(buffer.read(), content_type='application/zip')
+        response = StreamingHttpResponse(zs, content_type='application/zip')
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if zs.sized:
+            response['Content-Length'] = len(zs)
         return response
     
     def stream_all_products_zip(self, job) -> HttpResponse:
@@ -95,6 +101,15 @@ class ZipService:
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
     
+    def _iter_storage_file(self, file_path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Yield a file from default storage in chunks"""
+        with default_storage.open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    
     def _file_exists(self, file_path: str) -> bool:
         """Check if file exists (works for both local and S3)"""
         if settings.MEDIA_BACKEND == 's3':
@@ -0,0 +1,147 @@
+"""
+Test the async Server-Sent Events progress stream
+"""
+import zlib
+import orjson
+from asgiref.sync import sync_to_async
+from unittest.mock import patch, AsyncMock
+from django.test import TestCase, AsyncRequestFactory
+from django.urls import reverse
+from batch_downloader.models import DownloadJob, ProductBatch
+from batch_downloader.services.progress import progress_service
+from batch_downloader import views_sse
+
+
+@patch('batch_downloader.views_sse.asyncio.sleep', new_callable=AsyncMock)
+class ProgressStreamTest(TestCase):
+    """Test the snapshot/delta protocol of views_sse.job_progress_stream"""
+    
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        
+        self.job = DownloadJob.objects.create(
+            total_products=1,
+            total_images=2,
+            status='RUNNING'
+        )
+        
+        self.product = ProductBatch.objects.create(
+            job=self.job,
+            product_number="PROD1",
+            image_count=2
+        )
+        progress_service.bump_job_version(self.job.id)
+
+    def parse_frames(self, chunk):
+        """Split a stream chunk into (event, data) pairs"""
+        frames = []
+        for block in chunk.decode().split('\n\n'):
+            if block and not block.startswith(':'):
+                event, data = block.split('\n', 1)
+                frames.append((event[len('event: '):], data[len('data: '):]))
+        return frames
+
+    def apply_delta(self, state, delta):
+        """Merge a delta into a snapshot the way job_detail.html does"""
+        state['job'].update(delta['job'])
+        products = {p['product_number']: i for i, p in enumerate(state['products'])}
+        for product in delta['products_changed']:
+            if product['product_number'] in products:
+                state['products'][products[product['product_number']]] = product
+            else:
+                state['products'].append(product)
+
+    async def get_stream(self, **headers):
+        response = await views_sse.job_progress_stream(self.factory.get('/', headers=headers), self.job.id)
+        return response, response.streaming_content.__aiter__()
+
+    async def test_snapshot_then_delta_then_complete(self, mock_sleep):
+        """Test that a stream sends a snapshot, then deltas, then closes"""
+        response, stream = await self.get_stream()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        
+        frame = await stream.__anext__()
+        self.assertTrue(frame.startswith(b'event: snapshot\ndata: '))
+        self.assertIn(b'"product_number":"PROD1"', frame)
+        
+        # Only the changed product and job fields are sent
+        await ProductBatch.objects.filter(pk=self.product.pk).aupdate(downloaded_count=1)
+        progress_service.bump_job_version(self.job.id)
+        frame = await stream.__anext__()
+        self.assertTrue(frame.startswith(b'event: delta\ndata: '))
+        self.assertIn(b'"products_changed":[{"product_number":"PROD1"', frame)
+        self.assertIn(b'"downloaded_count":1', frame)
+        
+        # The final delta and the complete event arrive together
+        await DownloadJob.objects.filter(pk=self.job.pk).aupdate(status='COMPLETED')
+        progress_service.bump_job_version(self.job.id)
+        frame = await stream.__anext__()
+        self.assertIn(b'event: delta\ndata: {"job":{"status":"COMPLETED"}', frame)
+        self.assertTrue(frame.endswith(b'event: complete\ndata: Job completed\n\n'))
+        
+        with self.assertRaises(StopAsyncIteration):
+            await stream.__anext__()
+
+    async def test_finished_job_short_circuits(self, mock_sleep):
+        """Test that a finished job gets one snapshot and the stream closes"""
+        await DownloadJob.objects.filter(pk=self.job.pk).aupdate(status='FAILED')
+        
+        response, stream = await self.get_stream()
+        frames = [frame async for frame in stream]
+        
+        self.assertEqual(len(frames), 1)
+        self.assertTrue(frames[0].startswith(b'event: snapshot\ndata: '))
+        self.assertTrue(frames[0].endswith(b'event: complete\ndata: Job failed\n\n'))
+        mock_sleep.assert_not_awaited()
+
+    async def test_gzip_stream_decodes(self, mock_sleep):
+        """Test that the gzip stream decodes to the same frames"""
+        await DownloadJob.objects.filter(pk=self.job.pk).aupdate(status='COMPLETED')
+        
+        response, stream = await self.get_stream(accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        
+        body = zlib.decompress(b''.join([frame async for frame in stream]), wbits=31)
+        self.assertTrue(body.startswith(b'event: snapshot\ndata: '))
+        self.assertTrue(body.endswith(b'event: complete\ndata: Job completed\n\n'))
+
+    async def test_plain_stream_without_gzip(self, mock_sleep):
+        """Test that clients not accepting gzip get an uncompressed stream"""
+        response, stream = await self.get_stream()
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    async def test_stream_closes_at_deadline(self, mock_sleep):
+        """Test that an active stream stops once its deadline has passed"""
+        with patch.object(views_sse, 'SSE_MAX_STREAM_SECONDS', 0):
+            response, stream = await self.get_stream()
+            frames = [frame async for frame in stream]
+        
+        self.assertEqual(frames, [])
+
+    async def test_deltas_rebuild_full_payload(self, mock_sleep):
+        """Test that a snapshot patched with deltas matches a fresh snapshot"""
+        await ProductBatch.objects.acreate(job=self.job, product_number="PROD2", image_count=3)
+        response, stream = await self.get_stream()
+        
+        [(event, data)] = self.parse_frames(await stream.__anext__())
+        self.assertEqual(event, 'snapshot')
+        state = orjson.loads(data)
+        
+        await ProductBatch.objects.filter(pk=self.product.pk).aupdate(downloaded_count=2, bytes_downloaded=4096)
+        await DownloadJob.objects.filter(pk=self.job.pk).aupdate(completed_images=2, status='COMPLETED')
+        progress_service.bump_job_version(self.job.id)
+        
+        frames = self.parse_frames(await stream.__anext__())
+        self.assertEqual([event for event, data in frames], ['delta', 'complete'])
+        self.apply_delta(state, orjson.loads(frames[0][1]))
+        
+        expected, _ = await sync_to_async(views_sse._encode_job_progress)(self.job)
+        self.assertEqual(state, expected)
+
+    def test_job_detail_listens_for_stream_events(self, mock_sleep):
+        """Test that the progress page handles the named events the stream sends"""
+        response = self.client.get(reverse('batch_downloader:job_detail', args=[self.job.id]))
+        
+        for event in ['snapshot', 'delta', 'complete']:
+            self.assertContains(response, f"eventSource.addEventListener('{event}'")
+        self.assertContains(response, 'delta.products_changed')
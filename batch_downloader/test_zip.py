@@ -4,7 +4,7 @@ Test ZIP file creation functionality
 import os
 import tempfile
 import zipfile
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from unittest.mock import patch, Mock
 from batch_downloader.models import DownloadJob, ProductBatch, ImageItem
 from batch_downloader.services.simple_downloader import SimpleDownloadService
@@ -12,6 +12,9 @@ from batch_downloader.services.zip_service import zip_service
 from django.conf import settings
 
 
+# The mocked downloads write to the test DB, which worker threads can't
+# share with the test transaction, so download sequentially here
+@override_settings(DOWNLOAD_WORKERS=1)
 class ZipCreationTest(TestCase):
     """Test ZIP file creation after job completion"""
     
@@ -173,7 +176,7 @@ class ZipCreationTest(TestCase):
         
         # Verify ZIP content
         import io
-        zip_data = io.BytesIO(response.content)
+        zip_data = io.BytesIO(b''.join(response.streaming_content))
         with zipfile.ZipFile(zip_data, 'r') as zf:
             files_in_zip = zf.namelist()
             self.assertEqual(len(files_in_zip), 2)
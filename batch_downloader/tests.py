@@ -1,15 +1,20 @@
 import os
 import tempfile
 import shutil
+import threading
 from unittest.mock import Mock, patch, MagicMock
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.core.files.uploadedfile import SimpleUploadedFile
 import json
 
 from batch_downloader.models import DownloadJob, ProductBatch, ImageItem
+from batch_downloader.services import simple_downloader
 from batch_downloader.services.simple_downloader import SimpleDownloadService
+from batch_downloader.services.progress import progress_service
 from batch_downloader.forms import BatchDataForm
 
 
@@ -76,6 +81,32 @@ class SimpleDownloadServiceTest(TestCase):
         self.assertTrue(result)
         mock_get.assert_called_once()
 
+    @patch('requests.get')
+    def test_download_image_same_basename_keeps_both_files(self, mock_get):
+        """Test that images whose URLs share a basename get separate files"""
+        other_item = ImageItem.objects.create(
+            product_batch=self.product_batch,
+            url="http://example.com/other/image1.jpg?v=2",
+            status='PENDING'
+        )
+        
+        first, second = Mock(), Mock()
+        for response, content in [(first, b'first image'), (second, b'second image')]:
+            response.status_code = 200
+            response.headers = {'content-type': 'image/jpeg'}
+            response.iter_content = Mock(return_value=[content])
+        mock_get.side_effect = [first, second]
+        
+        self.service.download_image(self.image_item)
+        self.service.download_image(other_item)
+        
+        self.assertEqual(self.image_item.filename, other_item.filename)
+        self.assertNotEqual(self.image_item.file_path, other_item.file_path)
+        with open(self.image_item.file_path, 'rb') as f:
+            self.assertEqual(f.read(), b'first image')
+        with open(other_item.file_path, 'rb') as f:
+            self.assertEqual(f.read(), b'second image')
+
     @patch('requests.get')
     def test_download_image_failure(self, mock_get):
         """Test failed image download"""
@@ -86,6 +117,26 @@ class SimpleDownloadServiceTest(TestCase):
         
         self.assertFalse(result)
 
+    @patch('batch_downloader.services.simple_downloader.time.sleep')
+    @patch('requests.get')
+    def test_download_image_retries_transient_errors(self, mock_get, mock_sleep):
+        """Test that transient HTTP errors are retried"""
+        # First attempt gets a 503, second succeeds
+        unavailable = Mock()
+        unavailable.status_code = 503
+        
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'content-type': 'image/jpeg'}
+        mock_response.iter_content = Mock(return_value=[b'fake image content'])
+        mock_get.side_effect = [unavailable, mock_response]
+        
+        result, message = self.service.download_image(self.image_item)
+        
+        self.assertTrue(result)
+        self.assertEqual(mock_get.call_count, 2)
+        unavailable.close.assert_called_once()
+
     @patch('batch_downloader.services.simple_downloader.SimpleDownloadService.download_image')
     def test_process_job_success(self, mock_download):
         """Test successful job processing"""
@@ -110,6 +161,26 @@ class SimpleDownloadServiceTest(TestCase):
         self.assertEqual(self.job.status, 'FAILED')
         self.assertEqual(self.job.failed_images, 1)
 
+    @patch('batch_downloader.services.simple_downloader.SimpleDownloadService.download_image')
+    def test_process_job_retries_failed_images_once(self, mock_download):
+        """Test that retrying a FAILED image replaces its earlier failure in the counters"""
+        # State left by an earlier run of this job that failed the image
+        ImageItem.objects.filter(pk=self.image_item.pk).update(status='FAILED')
+        ProductBatch.objects.filter(pk=self.product_batch.pk).update(failed_count=1)
+        DownloadJob.objects.filter(pk=self.job.pk).update(status='RUNNING', failed_images=1)
+        
+        for success, failed in [(False, 1), (True, 0)]:
+            mock_download.return_value = (success, "Result")
+            DownloadJob.objects.filter(pk=self.job.pk).update(status='RUNNING')
+            self.service.process_job(self.job)
+            
+            self.job.refresh_from_db()
+            self.product_batch.refresh_from_db()
+            self.assertEqual(self.job.failed_images, failed)
+            self.assertEqual(self.product_batch.failed_count, failed)
+        
+        self.assertEqual(self.job.completed_images, 1)
+
     def test_pause_resume_functionality(self):
         """Test pause and resume functionality"""
         # The service doesn't have built-in pause/resume, 
@@ -124,6 +195,147 @@ class SimpleDownloadServiceTest(TestCase):
             # Should not call download_image when paused since processing exits early
             mock_download.assert_not_called()
 
+    def test_process_job_respects_cancel_while_queued(self):
+        """Test that a job cancelled while queued is not restarted"""
+        # self.job is the stale PENDING instance handed to the job queue
+        DownloadJob.objects.filter(pk=self.job.pk).update(status='CANCELLED')
+        
+        with patch.object(self.service, 'download_image') as mock_download:
+            self.service.process_job(self.job)
+            mock_download.assert_not_called()
+        
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'CANCELLED')
+
+    def test_shutdown_pauses_running_job(self):
+        """Test that a process shutdown pauses the job after the current image"""
+        self.addCleanup(simple_downloader._shutdown.clear)
+        
+        def download_then_shutdown(image_item):
+            simple_downloader.request_shutdown()
+            return True, "Success"
+        
+        with patch.object(self.service, 'download_image', side_effect=download_then_shutdown):
+            self.service.process_job(self.job)
+        
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'PAUSED')
+        self.assertEqual(self.job.completed_images, 1)
+
+    def test_shutdown_leaves_queued_job_pending(self):
+        """Test that a job queued behind a shutdown is not started"""
+        self.addCleanup(simple_downloader._shutdown.clear)
+        simple_downloader.request_shutdown()
+        
+        with patch.object(self.service, 'download_image') as mock_download:
+            self.service.process_job(self.job)
+            mock_download.assert_not_called()
+        
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'PENDING')
+
+
+# Pool threads need their own DB connections, so the rows must be committed
+@override_settings(DOWNLOAD_WORKERS=4)
+class ParallelDownloadTest(TransactionTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.original_media_root = settings.MEDIA_ROOT
+        settings.MEDIA_ROOT = self.temp_dir
+        
+        self.job = DownloadJob.objects.create(
+            total_products=1,
+            total_images=40,
+            status='PENDING'
+        )
+        self.product_batch = ProductBatch.objects.create(
+            job=self.job,
+            product_number="PROD1",
+            image_count=40
+        )
+        ImageItem.objects.bulk_create([
+            ImageItem(product_batch=self.product_batch, url=f"http://example.com/image{i}.jpg")
+            for i in range(40)
+        ])
+        
+        self.service = SimpleDownloadService()
+
+    def tearDown(self):
+        settings.MEDIA_ROOT = self.original_media_root
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def mock_response(self):
+        response = Mock()
+        response.status_code = 200
+        response.headers = {'content-type': 'image/jpeg'}
+        response.iter_content = Mock(return_value=[b'fake image content'])
+        return response
+
+    def assertCountersMatchImages(self):
+        self.job.refresh_from_db()
+        self.product_batch.refresh_from_db()
+        done = self.product_batch.images.filter(status='DONE').count()
+        self.assertEqual(self.product_batch.downloaded_count, done)
+        self.assertEqual(self.job.completed_images, done)
+        return done
+
+    @patch('requests.get')
+    def test_parallel_downloads_update_counters(self, mock_get):
+        """Test that every parallel download is counted"""
+        mock_get.side_effect = lambda *args, **kwargs: self.mock_response()
+        
+        self.service.process_job(self.job)
+        
+        self.assertEqual(self.assertCountersMatchImages(), 40)
+        self.assertEqual(self.job.status, 'COMPLETED')
+        self.assertEqual(self.product_batch.status, 'COMPLETED')
+
+    @patch('requests.get')
+    def test_pause_resume_keeps_counters(self, mock_get):
+        """Test that downloads in flight at pause time are still counted"""
+        record_result = self.service._record_result
+        drain_downloads = self.service._drain_downloads
+        stopped = threading.Event()
+        calls = []
+        results = []
+        
+        # Downloads after the first ten are held until the queue is cancelled,
+        # so some images are still in flight and some never start
+        def download_held(*args, **kwargs):
+            calls.append(1)
+            if len(calls) > 10:
+                stopped.wait(timeout=5)
+            return self.mock_response()
+        
+        # Pause from the coordinator thread; pool threads writing to SQLite's
+        # shared in-memory test DB can hit "database table is locked"
+        def pause_midway(*args):
+            record_result(*args)
+            results.append(1)
+            if len(results) == 10:
+                DownloadJob.objects.filter(pk=self.job.pk).update(status='PAUSED')
+        
+        def release_after_cancel(futures):
+            for future in futures:
+                future.cancel()
+            stopped.set()
+            return drain_downloads(futures)
+        
+        mock_get.side_effect = download_held
+        with patch.object(self.service, '_record_result', side_effect=pause_midway), \
+                patch.object(self.service, '_drain_downloads', side_effect=release_after_cancel):
+            self.service.process_job(self.job)
+        self.assertLess(self.assertCountersMatchImages(), 40)
+        self.assertEqual(self.job.status, 'PAUSED')
+        
+        # Resume as resume_job does
+        DownloadJob.objects.filter(pk=self.job.pk).update(status='RUNNING')
+        self.service.process_job(self.job)
+        
+        self.assertEqual(self.assertCountersMatchImages(), 40)
+        self.assertEqual(self.job.status, 'COMPLETED')
+        self.assertEqual(self.product_batch.status, 'COMPLETED')
+
 
 class BatchDownloaderViewsTest(TestCase):
     def setUp(self):
@@ -189,6 +401,23 @@ class BatchDownloaderViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['job'], job)
 
+    def test_job_detail_total_size_from_rendered_products(self):
+        """Test that the job size is summed from the products the page lists"""
+        job = DownloadJob.objects.create(
+            total_products=2,
+            total_images=2,
+            status='COMPLETED'
+        )
+        for number in ['PROD1', 'PROD2']:
+            ProductBatch.objects.create(job=job, product_number=number, image_count=1, bytes_downloaded=1024 * 1024)
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('batch_downloader:job_detail', args=[job.id]), {'sort_by': 'status'})
+        
+        self.assertEqual(response.context['total_size_mb'], 2)
+        size_queries = [q for q in queries if '"batch_downloader_productbatch"."bytes_downloaded"' in q['sql']]
+        self.assertEqual(len(size_queries), 1)
+
     def test_pause_job_view(self):
         """Test pause job functionality"""
         job = DownloadJob.objects.create(
@@ -247,6 +476,31 @@ class BatchDownloaderViewsTest(TestCase):
         self.assertEqual(job.status, 'PENDING')
         self.assertEqual(job.completed_images, 0)
 
+    @override_settings(ZIP_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_download_product_zip_accel_redirect(self):
+        """Test prebuilt ZIPs are handed off to nginx when configured"""
+        job = DownloadJob.objects.create(
+            total_products=1,
+            total_images=1,
+            status='COMPLETED'
+        )
+        zip_path = os.path.join(self.temp_dir, 'zips', 'PROD1.zip')
+        os.makedirs(os.path.dirname(zip_path))
+        with open(zip_path, 'wb') as f:
+            f.write(b'fake zip content')
+        ProductBatch.objects.create(
+            job=job,
+            product_number="PROD1",
+            image_count=1,
+            zip_ready=True,
+            zip_path=zip_path
+        )
+        
+        response = self.client.get(reverse('batch_downloader:download_product_zip', args=[job.id, 'PROD1']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/zips/PROD1.zip')
+        self.assertEqual(response.content, b'')
+
     def test_job_progress_sse(self):
         """Test job progress SSE endpoint"""
         job = DownloadJob.objects.create(
@@ -255,10 +509,41 @@ class BatchDownloaderViewsTest(TestCase):
             status='RUNNING'
         )
         
-        response = self.client.get(reverse('batch_downloader:job_progress', args=[job.id]))
+        response = self.client.get(reverse('batch_downloader:job_progress_stream', args=[job.id]))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'text/event-stream')
 
+    @patch('batch_downloader.views.SSE_RESYNC_TICKS', 100)
+    @patch('batch_downloader.views.time.sleep')
+    def test_job_progress_sse_skips_db_until_version_changes(self, mock_sleep):
+        """Test that SSE ticks skip the DB while the progress version is unchanged"""
+        job = DownloadJob.objects.create(
+            total_products=1,
+            total_images=1,
+            status='RUNNING'
+        )
+        ProductBatch.objects.create(
+            job=job,
+            product_number="PROD1",
+            image_count=1
+        )
+        progress_service.bump_job_version(job.id)
+        
+        response = self.client.get(reverse('batch_downloader:job_progress_stream', args=[job.id]))
+        stream = iter(response.streaming_content)
+        self.assertTrue(next(stream).startswith(b'data: '))
+        
+        # Every tick up to the heartbeat only reads the cached version
+        with self.assertNumQueries(0):
+            self.assertTrue(next(stream).startswith(b': heartbeat'))
+        
+        # A version bump brings the next tick back to the DB
+        progress_service.bump_job_version(job.id)
+        DownloadJob.objects.filter(pk=job.pk).update(status='COMPLETED')
+        with self.assertNumQueries(1):
+            frame = next(stream)
+        self.assertIn(b'"final_update":true', frame)
+
 
 class BatchDataFormTest(TestCase):
     def test_valid_form_data(self):
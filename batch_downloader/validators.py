@@ -20,21 +20,16 @@ class ImageRow(BaseModel):
     
     @validator('image_src')
     def validate_image_url(cls, v):
-        # Convert to string for validation
         url_str = str(v)
         
         # Check length
         if len(url_str) > 2048:
             raise ValueError('URL length cannot exceed 2048 characters')
         
-        # Must be HTTP/HTTPS
-        if not url_str.startswith(('http://', 'https://')):
+        # Must be HTTP/HTTPS (this also rules out data: URIs)
+        if not (url_str.startswith('http://') or url_str.startswith('https://')):
             raise ValueError('Only HTTP/HTTPS URLs are allowed')
         
-        # Reject data URIs
-        if url_str.startswith('data:'):
-            raise ValueError('Data URIs are not allowed')
-        
         return v
 
 
@@ -50,19 +45,21 @@ class BatchValidationResult(BaseModel):
         return len(self.valid_rows) > 0 and len(self.errors) == 0
 
 
+# Known column header aliases mapped to their canonical names
+_HEADER_MAP = {
+    alias: 'product_number'
+    for alias in ('product number', 'product', 'productid', 'product_id', 'product_number')
+}
+_HEADER_MAP.update({
+    alias: 'image_src'
+    for alias in ('image src', 'image url', 'image_src', 'image_url', 'imageurl', 'imagesrc')
+})
+
+
 def normalize_header(header: str) -> str:
     """Normalize column headers to match expected format"""
     header = header.strip().lower()
-    
-    # Product number variations
-    if header in ['product number', 'product', 'productid', 'product_id', 'product_number']:
-        return 'product_number'
-    
-    # Image URL variations
-    if header in ['image src', 'image url', 'image_src', 'image_url', 'imageurl', 'imagesrc']:
-        return 'image_src'
-    
-    return header
+    return _HEADER_MAP.get(header, header)
 
 
 def validate_csv_data(data: List[List[str]]) -> BatchValidationResult:
@@ -174,21 +171,15 @@ def validate_pandas_dataframe(df: pd.DataFrame) -> BatchValidationResult:
 
 def deduplicate_images_per_product(rows: List[ImageRow]) -> Tuple[List[ImageRow], List[str]]:
     """Remove duplicate URLs per product, return cleaned list and warnings"""
-    product_urls = {}
-    deduplicated = []
-    warnings = []
-    
+    # First occurrence of each (product, url) pair wins; dicts keep insertion order
+    unique_rows = {}
     for row in rows:
-        product = row.product_number
-        url = str(row.image_src)
-        
-        if product not in product_urls:
-            product_urls[product] = set()
-        
-        if url not in product_urls[product]:
-            product_urls[product].add(url)
-            deduplicated.append(row)
-        else:
-            warnings.append(f"Duplicate URL for product {product}: {url}")
+        unique_rows.setdefault((row.product_number, str(row.image_src)), row)
+    deduplicated = list(unique_rows.values())
+    
+    warnings = []
+    removed_count = len(rows) - len(deduplicated)
+    if removed_count > 0:
+        warnings.append(f"Removed {removed_count} duplicate image(s)")
     
     return deduplicated, warnings
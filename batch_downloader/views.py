@@ -1,32 +1,73 @@
-import json
 import os
 import re
+import shutil
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Dict, List
 
+import orjson
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, Http404, HttpResponse
+from django.http import FileResponse, JsonResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods, require_POST, require_GET
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 from django.contrib import messages
-from django.db import transaction
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
 from django.urls import reverse
 
 from .models import DownloadJob, ProductBatch, ImageItem
 from .forms import CSVUploadForm, BatchDataForm
+from .validators import deduplicate_images_per_product
 from .services.zip_service import zip_service
+from .services.progress import SSE_RESYNC_TICKS, progress_service
+from .services.simple_downloader import SimpleDownloadService
 
 
+# Shared pool for background job processing so bursts of requests can't
+# spawn an unbounded number of downloader threads / DB connections
+_JOB_EXECUTOR = ThreadPoolExecutor(max_workers=settings.JOB_WORKERS, thread_name_prefix='job')
+
+
+def _run_job(job):
+    """Run a download job on a pool thread, marking it failed on error"""
+    close_old_connections()
+    try:
+        SimpleDownloadService().process_job(job)
+    except Exception as e:
+        print(f"Job processing error: {e}")
+        DownloadJob.objects.filter(pk=job.pk).update(status='FAILED')
+    finally:
+        close_old_connections()
+
+
+def submit_job(job):
+    """Queue a job for background processing"""
+    return _JOB_EXECUTOR.submit(_run_job, job)
+
+
+_NATURAL_CHUNK_RE = re.compile(r'\d+|\D+')
+
+
+@lru_cache(maxsize=4096)
 def natural_sort_key(text):
-    """Convert a string into a list of string and number chunks."""
-    def convert(match):
-        return int(match.group()) if match.group().isdigit() else match.group().lower()
-    return [convert(match) for match in re.finditer(r'\d+|\D+', text)]
+    """Convert a string into a tuple of string and number chunks."""
+    return tuple(
+        int(chunk) if chunk.isdigit() else chunk.lower()
+        for chunk in _NATURAL_CHUNK_RE.findall(text)
+    )
 
 
 def get_sorted_products(job, sort_by='natural', sort_order='asc'):
     """Get products sorted by different methods"""
-    products = ProductBatch.objects.filter(job=job).prefetch_related('images')
+    # Only the counters shown on the product cards are needed; failed images
+    # are fetched per card only for FAILED/PARTIAL products
+    products = ProductBatch.objects.filter(job=job).only(
+        'job', 'product_number', 'status', 'image_count', 'downloaded_count',
+        'failed_count', 'bytes_downloaded', 'zip_ready', 'zip_size', 'created_at'
+    )
     
     if sort_by == 'natural':
         products_list = list(products)
@@ -47,27 +88,6 @@ def get_sorted_products(job, sort_by='natural', sort_order='asc'):
         return products_list
 
 
-def deduplicate_images_per_product(image_rows):
-    """Remove duplicate image URLs per product."""
-    seen_combinations = set()
-    deduplicated_rows = []
-    warnings = []
-    
-    for row in image_rows:
-        combination = (row.product_number, row.image_src)
-        if combination not in seen_combinations:
-            seen_combinations.add(combination)
-            deduplicated_rows.append(row)
-        else:
-            warnings.append(f"Duplicate image removed: {row.image_src} for product {row.product_number}")
-    
-    removed_count = len(image_rows) - len(deduplicated_rows)
-    if removed_count > 0:
-        warnings.insert(0, f"Removed {removed_count} duplicate image(s)")
-    
-    return deduplicated_rows, warnings
-
-
 def create_download_job(image_rows, user=None):
     """Create a download job from validated image rows"""
     # Deduplicate images per product
@@ -87,41 +107,21 @@ def create_download_job(image_rows, user=None):
             status='PENDING'
         )
         
-        # Create product batches and image items
-        for product_number, rows in products_data.items():
-            product_batch = ProductBatch.objects.create(
-                job=job,
-                product_number=product_number,
-                image_count=len(rows)
-            )
-            
-            # Create image items
-            image_items = []
-            for row in rows:
-                image_items.append(ImageItem(
-                    product_batch=product_batch,
-                    url=str(row.image_src),
-                    status='PENDING'
-                ))
-            
-            ImageItem.objects.bulk_create(image_items)
+        # Create product batches, then all image items, in one bulk insert each
+        product_batches = ProductBatch.objects.bulk_create([
+            ProductBatch(job=job, product_number=product_number, image_count=len(rows))
+            for product_number, rows in products_data.items()
+        ], batch_size=500)
         
-        # Start the download job using simple downloader
-        from .services.simple_downloader import SimpleDownloadService
-        downloader = SimpleDownloadService()
+        image_items = [
+            ImageItem(product_batch=product_batch, url=str(row.image_src), status='PENDING')
+            for product_batch in product_batches
+            for row in products_data[product_batch.product_number]
+        ]
+        ImageItem.objects.bulk_create(image_items, batch_size=1000)
         
-        def process_job():
-            try:
-                downloader.process_job(job)
-            except Exception as e:
-                print(f"Job processing error: {e}")
-                job.status = 'FAILED'
-                job.save()
-        
-        import threading
-        thread = threading.Thread(target=process_job)
-        thread.daemon = True
-        thread.start()
+        # Start the download job once the rows are committed
+        transaction.on_commit(lambda: submit_job(job))
         
         return job
 
@@ -167,6 +167,71 @@ def create_job(request):
         }, status=400)
 
 
+# ProductBatch columns needed to build a progress payload
+PRODUCT_PROGRESS_FIELDS = (
+    'product_number', 'status', 'downloaded_count', 'image_count', 'bytes_downloaded', 'zip_ready',
+)
+
+
+# DownloadJob columns refreshed on every SSE tick, spanned from ProductBatch
+JOB_PROGRESS_FIELDS = ('job__status', 'job__completed_images', 'job__total_images')
+
+
+def _product_progress(row):
+    """Build the progress payload for a ProductBatch ``values()`` row"""
+    image_count = row['image_count']
+    return {
+        'product_number': row['product_number'],
+        'status': row['status'],
+        'progress_percentage': int((row['downloaded_count'] / image_count) * 100) if image_count else 0,
+        'downloaded_count': row['downloaded_count'],
+        'image_count': image_count,
+        'bytes_downloaded_mb': round(row['bytes_downloaded'] / (1024 * 1024), 2),
+        'zip_ready': row['zip_ready'],
+    }
+
+
+def _job_progress_data(job, rows=None):
+    """Build the progress payload for a job and its products"""
+    if rows is None:
+        rows = ProductBatch.objects.filter(job=job).order_by('product_number').values(*PRODUCT_PROGRESS_FIELDS)
+    
+    products_data = []
+    total_bytes = 0
+    for row in rows:
+        products_data.append(_product_progress(row))
+        total_bytes += row['bytes_downloaded']
+    
+    return {
+        'job': {
+            'id': str(job.id),
+            'status': job.status,
+            'progress_percentage': job.progress_percentage,
+            'completed_images': job.completed_images,
+            'total_images': job.total_images,
+            'total_size_mb': round(total_bytes / (1024 * 1024), 2),
+        },
+        'products': products_data,
+        'final_update': job.status in ['COMPLETED', 'FAILED', 'CANCELLED']
+    }
+
+
+def _job_progress_snapshot(job):
+    """Refresh the job counters and build its progress payload in one query"""
+    # Pull the job columns alongside each product row via the FK join
+    rows = list(
+        ProductBatch.objects.filter(job=job).order_by('product_number')
+        .values(*PRODUCT_PROGRESS_FIELDS, *JOB_PROGRESS_FIELDS)
+    )
+    if rows:
+        for field in JOB_PROGRESS_FIELDS:
+            setattr(job, field.split('__', 1)[1], rows[0][field])
+    else:
+        job.refresh_from_db(fields=[field.split('__', 1)[1] for field in JOB_PROGRESS_FIELDS])
+    
+    return _job_progress_data(job, rows)
+
+
 def job_detail(request, job_id):
     """Job detail page with progress tracking"""
     job = get_object_or_404(DownloadJob, id=job_id)
@@ -175,38 +240,18 @@ def job_detail(request, job_id):
     sort_by = request.GET.get('sort_by', 'natural')
     sort_order = request.GET.get('sort_order', 'asc')
     
+    # Handle AJAX requests for polling; the client matches rows by product
+    # number, so skip the natural sort and let the DB order them
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse(_job_progress_data(job))
+    
     # Get product batches with sorting
     product_batches = get_sorted_products(job, sort_by, sort_order)
     
-    # Calculate overall statistics
+    # Calculate overall statistics from the products the page renders anyway;
+    # iterating a queryset here caches its rows for the template
     total_size_mb = sum(p.bytes_downloaded for p in product_batches) / (1024 * 1024)
     
-    # Handle AJAX requests for polling
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        products_data = []
-        for product in product_batches:
-            products_data.append({
-                'product_number': product.product_number,
-                'status': product.status,
-                'progress_percentage': product.progress_percentage,
-                'downloaded_count': product.downloaded_count,
-                'image_count': product.image_count,
-                'bytes_downloaded_mb': product.bytes_downloaded_mb,
-                'zip_ready': product.zip_ready,
-            })
-        
-        return JsonResponse({
-            'job': {
-                'id': str(job.id),
-                'status': job.status,
-                'progress_percentage': job.progress_percentage,
-                'completed_images': job.completed_images,
-                'total_images': job.total_images,
-                'total_size_mb': round(total_size_mb, 2),
-            },
-            'products': products_data
-        })
-    
     context = {
         'job': job,
         'product_batches': product_batches,
@@ -218,6 +263,18 @@ def job_detail(request, job_id):
     return render(request, 'batch_downloader/job_detail.html', context)
 
 
+def _accel_redirect_path(file_path):
+    """Map a file under MEDIA_ROOT to the nginx internal location, if configured"""
+    prefix = settings.ZIP_ACCEL_REDIRECT_PREFIX
+    if not prefix:
+        return None
+    
+    relative_path = os.path.relpath(file_path, settings.MEDIA_ROOT)
+    if relative_path.startswith(os.pardir):
+        return None
+    return prefix.rstrip('/') + '/' + relative_path.replace(os.sep, '/')
+
+
 def download_product_zip(request, job_id, product_number):
     """Download ZIP file for a specific product"""
     job = get_object_or_404(DownloadJob, id=job_id)
@@ -226,6 +283,23 @@ def download_product_zip(request, job_id, product_number):
     if not product.zip_ready:
         raise Http404("ZIP file not ready")
     
+    # Serve the prebuilt ZIP straight from disk when we have one
+    if product.zip_path and os.path.isfile(product.zip_path):
+        accel_path = _accel_redirect_path(product.zip_path)
+        if accel_path:
+            # Let nginx send the file from its internal location
+            response = HttpResponse(content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="{product.product_number}.zip"'
+            response['X-Accel-Redirect'] = accel_path
+            return response
+        
+        return FileResponse(
+            open(product.zip_path, 'rb'),
+            as_attachment=True,
+            filename=f"{product.product_number}.zip",
+            content_type='application/zip'
+        )
+    
     return zip_service.stream_product_zip(product)
 
 
@@ -238,101 +312,55 @@ def download_job_zip(request, job_id):
 @require_http_methods(["GET"])
 def job_progress_stream(request, job_id):
     """Server-sent events endpoint for real-time job progress updates"""
-    import time
-    from django.http import StreamingHttpResponse
-    
     job = get_object_or_404(DownloadJob, id=job_id)
     
     def event_stream():
         # Check if job is already completed
         if job.status in ['COMPLETED', 'FAILED', 'CANCELLED']:
             # For completed jobs, send one final update and close
-            job.refresh_from_db()
-            
-            # Get updated product data
-            product_batches = ProductBatch.objects.filter(job=job).prefetch_related('images').order_by('product_number')
-            
-            products_data = []
-            total_size_mb = 0
-            for product in product_batches:
-                products_data.append({
-                    'product_number': product.product_number,
-                    'status': product.status,
-                    'progress_percentage': product.progress_percentage,
-                    'downloaded_count': product.downloaded_count,
-                    'image_count': product.image_count,
-                    'bytes_downloaded_mb': product.bytes_downloaded_mb,
-                    'zip_ready': product.zip_ready,
-                })
-                total_size_mb += product.bytes_downloaded / (1024 * 1024) if product.bytes_downloaded else 0
-            
-            # Prepare SSE data
-            progress_data = {
-                'job': {
-                    'id': str(job.id),
-                    'status': job.status,
-                    'progress_percentage': job.progress_percentage,
-                    'completed_images': job.completed_images,
-                    'total_images': job.total_images,
-                    'total_size_mb': round(total_size_mb, 2),
-                },
-                'products': products_data,
-                'final_update': True
-            }
+            progress_data = _job_progress_snapshot(job)
+            progress_data['final_update'] = True
             
-            # Send final update and close
-            yield f"data: {json.dumps(progress_data)}\n\n"
+            yield b"data: " + orjson.dumps(progress_data) + b"\n\n"
             return
         
-        # For active jobs, stream updates
+        # For active jobs, stream updates. The downloader bumps a per-job
+        # progress version in the cache, so ticks where it hasn't moved skip
+        # the DB entirely. A full snapshot is still taken every
+        # SSE_RESYNC_TICKS ticks in case the job is running in a process
+        # that doesn't share this cache.
         max_updates = 300
         update_count = 0
+        last_version = None
+        last_frame = None
+        idle_ticks = 0
         
         while update_count < max_updates:
-            job.refresh_from_db()
-            
-            # Get updated product data
-            product_batches = ProductBatch.objects.filter(job=job).prefetch_related('images').order_by('product_number')
-            
-            products_data = []
-            total_size_mb = 0
-            for product in product_batches:
-                products_data.append({
-                    'product_number': product.product_number,
-                    'status': product.status,
-                    'progress_percentage': product.progress_percentage,
-                    'downloaded_count': product.downloaded_count,
-                    'image_count': product.image_count,
-                    'bytes_downloaded_mb': product.bytes_downloaded_mb,
-                    'zip_ready': product.zip_ready,
-                })
-                total_size_mb += product.bytes_downloaded / (1024 * 1024) if product.bytes_downloaded else 0
+            version = progress_service.get_job_version(job.id)
             
-            # Prepare SSE data
-            progress_data = {
-                'job': {
-                    'id': str(job.id),
-                    'status': job.status,
-                    'progress_percentage': job.progress_percentage,
-                    'completed_images': job.completed_images,
-                    'total_images': job.total_images,
-                    'total_size_mb': round(total_size_mb, 2),
-                },
-                'products': products_data,
-                'final_update': job.status in ['COMPLETED', 'FAILED', 'CANCELLED']
-            }
+            if version is None or version != last_version or idle_ticks >= SSE_RESYNC_TICKS:
+                last_version = version
+                idle_ticks = 0
+                progress_data = _job_progress_snapshot(job)
+                frame = b"data: " + orjson.dumps(progress_data) + b"\n\n"
+                
+                # Only send frames that differ from the last one; quiet
+                # periods are covered by the heartbeat below
+                if frame != last_frame:
+                    last_frame = frame
+                    yield frame
+                
+                # Break if job is completed after sending the update
+                if progress_data['final_update']:
+                    return
+            else:
+                idle_ticks += 1
             
-            # Send SSE formatted data
-            yield f"data: {json.dumps(progress_data)}\n\n"
             update_count += 1
             
-            # Break if job is completed after sending the update
-            if job.status in ['COMPLETED', 'FAILED', 'CANCELLED']:
-                return
-            
             # Send heartbeat every 15 updates to prevent timeouts (more frequent)
             if update_count % 15 == 0:
-                yield f": heartbeat-{update_count}\n\n"
+                yield b": heartbeat-%d\n\n" % update_count
             
             # Shorter sleep for more responsive updates
             time.sleep(0.5)
@@ -346,9 +374,6 @@ def job_progress_stream(request, job_id):
 @require_POST
 def delete_job(request, job_id):
     """Delete a job and all its data"""
-    import shutil
-    from django.conf import settings
-    
     job = get_object_or_404(DownloadJob, id=job_id)
     
     try:
@@ -380,37 +405,38 @@ def restart_job(request, job_id):
     job = get_object_or_404(DownloadJob, id=job_id)
     
     try:
-        if job.status in ['FAILED', 'CANCELLED']:
-            # Reset job status
-            job.status = 'PENDING'
-            job.completed_images = 0
-            job.failed_images = 0
-            job.save()
-            
-            # Reset all products
-            job.products.update(
-                status='PENDING',
-                downloaded_count=0,
-                bytes_downloaded=0,
-                zip_ready=False
-            )
-            
-            # Reset all images for this job
-            ImageItem.objects.filter(product_batch__job=job).update(
+        # Reset job, products and images in one transaction; filter on
+        # the FK columns directly so no join is needed for the UPDATEs
+        with transaction.atomic():
+            restarted = DownloadJob.objects.filter(
+                pk=job.pk,
+                status__in=['FAILED', 'CANCELLED']
+            ).update(
                 status='PENDING',
-                error_message='',
-                file_path='',
-                size_bytes=0
+                completed_images=0,
+                failed_images=0
             )
+            if restarted:
+                ProductBatch.objects.filter(job_id=job.pk).update(
+                    status='PENDING',
+                    downloaded_count=0,
+                    failed_count=0,
+                    bytes_downloaded=0,
+                    zip_ready=False
+                )
+                ImageItem.objects.filter(product_batch__job_id=job.pk).update(
+                    status='PENDING',
+                    error_message='',
+                    file_path='',
+                    size_bytes=0
+                )
+        
+        if restarted:
+            job.refresh_from_db()
+            progress_service.emit_job_progress(job.id, 'job.status_changed')
             
-            # Start the job using our simple downloader
-            from .services.simple_downloader import SimpleDownloadService
-            downloader = SimpleDownloadService()
-            
-            import threading
-            thread = threading.Thread(target=downloader.process_job, args=(job,))
-            thread.daemon = True
-            thread.start()
+            # Start the job outside the transaction so no locks are held
+            submit_job(job)
             
             messages.success(request, f"Job {job.short_id} restarted successfully")
             return JsonResponse({'success': True})
@@ -428,10 +454,14 @@ def cancel_job(request, job_id):
     job = get_object_or_404(DownloadJob, id=job_id)
     
     try:
-        if job.status in ['PENDING', 'RUNNING', 'PAUSED']:
-            job.status = 'CANCELLED'
-            job.save()
-            
+        # Conditional UPDATE so a concurrent status change can't be overwritten
+        cancelled = DownloadJob.objects.filter(
+            pk=job.pk,
+            status__in=['PENDING', 'RUNNING', 'PAUSED']
+        ).update(status='CANCELLED')
+        
+        if cancelled:
+            progress_service.emit_job_progress(job.id, 'job.status_changed')
             messages.success(request, f"Job {job.short_id} cancelled successfully")
             return JsonResponse({'success': True})
         else:
@@ -448,9 +478,11 @@ def pause_job(request, job_id):
     job = get_object_or_404(DownloadJob, id=job_id)
     
     try:
-        if job.status == 'RUNNING':
-            job.status = 'PAUSED'
-            job.save()
+        # Conditional UPDATE so the downloader's counter increments aren't overwritten
+        paused = DownloadJob.objects.filter(pk=job.pk, status='RUNNING').update(status='PAUSED')
+        
+        if paused:
+            progress_service.emit_job_progress(job.id, 'job.status_changed')
             
             messages.success(request, f"Job {job.short_id} paused successfully")
             return JsonResponse({'success': True})
@@ -468,18 +500,14 @@ def resume_job(request, job_id):
     job = get_object_or_404(DownloadJob, id=job_id)
     
     try:
-        if job.status == 'PAUSED':
+        resumed = DownloadJob.objects.filter(pk=job.pk, status='PAUSED').update(status='RUNNING')
+        
+        if resumed:
             job.status = 'RUNNING'
-            job.save()
+            progress_service.emit_job_progress(job.id, 'job.status_changed')
             
             # Resume download processing in background
-            from .services.simple_downloader import SimpleDownloadService
-            downloader = SimpleDownloadService()
-            
-            import threading
-            thread = threading.Thread(target=downloader.process_job, args=(job,))
-            thread.daemon = True
-            thread.start()
+            submit_job(job)
             
             messages.success(request, f"Job {job.short_id} resumed successfully")
             return JsonResponse({'success': True})
@@ -517,41 +545,46 @@ def upload_csv(request):
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
 
+# Static body for the sample CSV download
+SAMPLE_CSV = (
+    b'Product Number,Image Src\r\n'
+    b'PROD001,https://picsum.photos/800/600?random=1\r\n'
+    b'PROD001,https://picsum.photos/800/600?random=2\r\n'
+    b'PROD002,https://picsum.photos/800/600?random=3\r\n'
+)
+
+
 def sample_csv(request):
     """Download sample CSV file"""
-    import csv
-    from django.http import HttpResponse
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="sample_data.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Product Number', 'Image Src'])
-    writer.writerow(['PROD001', 'https://picsum.photos/800/600?random=1'])
-    writer.writerow(['PROD001', 'https://picsum.photos/800/600?random=2'])
-    writer.writerow(['PROD002', 'https://picsum.photos/800/600?random=3'])
-    
-    return response
+    return HttpResponse(SAMPLE_CSV, content_type='text/csv', headers={
+        'Content-Disposition': 'attachment; filename="sample_data.csv"',
+        'Cache-Control': 'public, max-age=86400',
+    })
 
 
-def system_check(request):
-    """System health check view"""
-    from django.conf import settings
-    
-    checks = {
-        'database': True,  # If we got here, database is working
-        'media_write': False,
-    }
-    
-    # Check media directory write permissions
+# How long the media write probe result is reused between system checks
+SYSTEM_CHECK_TTL = 10
+
+
+def _check_media_write():
+    """Check media directory write permissions"""
     try:
         test_file = os.path.join(settings.MEDIA_ROOT, 'test_write.txt')
         with open(test_file, 'w') as f:
             f.write('test')
         os.remove(test_file)
-        checks['media_write'] = True
+        return True
     except:
-        pass
+        return False
+
+
+def system_check(request):
+    """System health check view"""
+    checks = {
+        'database': True,  # If we got here, database is working
+        # Probes hit the filesystem, so reuse a recent result under frequent polling
+        'media_write': cache.get_or_set('system-check:media-write', _check_media_write, SYSTEM_CHECK_TTL),
+    }
     
     return JsonResponse({
         'status': 'ok' if all(checks.values()) else 'error',
@@ -1,77 +1,217 @@
-import json
+import asyncio
 import time
+import zlib
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
 from django.http import StreamingHttpResponse
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET
 
 from .models import DownloadJob, ProductBatch, ImageItem
+from .services.progress import SSE_RESYNC_TICKS, progress_service
+
+
+# Poll quickly while progress is moving and back off while it is idle
+SSE_MIN_INTERVAL = 0.5
+SSE_MAX_INTERVAL = 5.0
+SSE_BACKOFF = 1.5
+
+# Send a comment frame when nothing has been written for this long
+SSE_HEARTBEAT_SECONDS = 15
+
+# How long a progress payload is shared between clients
+SSE_PAYLOAD_TIMEOUT = 60
+
+# Close streams after this long; EventSource clients reconnect on their own
+SSE_MAX_STREAM_SECONDS = 60 * 60
+
+
+def _encode_job_progress(job):
+    """Refresh a job and return its progress payload alongside its encoded form"""
+    # Refresh only the job columns the payload reports
+    job_row = (
+        DownloadJob.objects.filter(pk=job.pk)
+        .values('status', 'total_images', 'completed_images', 'failed_images')
+        .get()
+    )
+    job.status = job_row['status']
+    total_images = job_row['total_images']
+    
+    # Fetch the products once as plain rows; the job total is summed from them
+    products = list(
+        ProductBatch.objects.filter(job=job)
+        .order_by('product_number')
+        .values('product_number', 'status', 'downloaded_count', 'failed_count',
+                'image_count', 'bytes_downloaded', 'zip_ready')
+    )
+    total_bytes = sum(p['bytes_downloaded'] for p in products)
+    
+    # Get current progress data
+    progress_data = {
+        'job': {
+            'id': str(job.id),
+            'status': job.status,
+            'total_images': total_images,
+            'completed_images': job_row['completed_images'],
+            'failed_images': job_row['failed_images'],
+            'progress_percentage': int((job_row['completed_images'] / total_images) * 100) if total_images else 0,
+            'total_size_mb': round(total_bytes / (1024 * 1024), 2)
+        },
+        'products': []
+    }
+    
+    # Get product progress (same arithmetic as the ProductBatch properties)
+    for product in products:
+        image_count = product['image_count']
+        progress_data['products'].append({
+            'product_number': product['product_number'],
+            'status': product['status'],
+            'downloaded_count': product['downloaded_count'],
+            'failed_count': product['failed_count'],
+            'image_count': image_count,
+            'progress_percentage': int((product['downloaded_count'] / image_count) * 100) if image_count else 0,
+            'size_mb': round(product['bytes_downloaded'] / (1024 * 1024), 2),
+            'zip_ready': product['zip_ready']
+        })
+    
+    return progress_data, orjson.dumps(progress_data)
+
+
+def _progress_delta(previous, current):
+    """Return the job fields and products that changed between two payloads, or None"""
+    job_patch = {key: value for key, value in current['job'].items() if previous['job'].get(key) != value}
+    
+    previous_products = {p['product_number']: p for p in previous['products']}
+    products_changed = [p for p in current['products'] if previous_products.get(p['product_number']) != p]
+    
+    if not job_patch and not products_changed:
+        return None
+    return {'job': job_patch, 'products_changed': products_changed}
+
+
+def _progress_cache_key(job_id):
+    """Cache key for a job's shared progress payload"""
+    return f'sse:job:{job_id}'
+
+
+async def _gzip_stream(stream):
+    """Gzip an async byte stream, flushing after each chunk so events aren't held back"""
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    async for chunk in stream:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
 
 
 @require_GET
-def job_progress_stream(request, job_id):
-    """Server-Sent Events stream for real-time job progress updates"""
+async def job_progress_stream(request, job_id):
+    """Server-Sent Events stream for real-time job progress updates (for ASGI deployments)"""
     
-    def event_stream():
+    async def event_stream():
         """Generator function for SSE stream"""
-        job = get_object_or_404(DownloadJob, id=job_id)
-        last_update = None
+        # Only the status is read from the instance; counters come from each tick's query
+        job = await aget_object_or_404(DownloadJob.objects.only('id', 'status'), id=job_id)
         
-        while True:
+        # Finished jobs get one snapshot and close without entering the poll loop
+        if job.status in ['COMPLETED', 'FAILED', 'CANCELLED']:
+            progress_data, snapshot = await sync_to_async(_encode_job_progress)(job)
+            yield (
+                b"event: snapshot\ndata: " + snapshot + b"\n\n"
+                b"event: complete\ndata: Job " + progress_data['job']['status'].lower().encode() + b"\n\n"
+            )
+            return
+        
+        last_progress = None
+        last_snapshot = None
+        last_version = None
+        idle_ticks = 0
+        last_sent = time.monotonic()
+        deadline = last_sent + SSE_MAX_STREAM_SECONDS
+        poll_interval = SSE_MIN_INTERVAL
+        
+        # Under ASGI a client disconnect cancels this generator at its next
+        # await; CancelledError is not an Exception, so it is never swallowed
+        while time.monotonic() < deadline:
+            # Frames produced in one tick are flushed together in a single write
+            buffer = bytearray()
+            finished = False
             try:
-                # Refresh job data
-                job.refresh_from_db()
-                
-                # Get current progress data
-                progress_data = {
-                    'job': {
-                        'id': str(job.id),
-                        'status': job.status,
-                        'total_images': job.total_images,
-                        'completed_images': job.completed_images,
-                        'failed_images': job.failed_images,
-                        'progress_percentage': job.progress_percentage,
-                        'total_size_mb': round(sum(p.bytes_downloaded for p in job.products.all()) / (1024 * 1024), 2)
-                    },
-                    'products': []
-                }
-                
-                # Get product progress
-                products = ProductBatch.objects.filter(job=job).order_by('product_number')
-                for product in products:
-                    progress_data['products'].append({
-                        'product_number': product.product_number,
-                        'status': product.status,
-                        'downloaded_count': product.downloaded_count,
-                        'failed_count': product.failed_count,
-                        'image_count': product.image_count,
-                        'progress_percentage': product.progress_percentage,
-                        'size_mb': product.bytes_downloaded_mb,
-                        'zip_ready': product.zip_ready
-                    })
+                # The downloader bumps a per-job version in the cache on every
+                # update, so only hit the DB when it moved (or to resync with
+                # workers in processes that don't share this cache)
+                version = await progress_service.aget_job_version(job.id)
+                resync = idle_ticks >= SSE_RESYNC_TICKS
+                if version is None or version != last_version or resync:
+                    last_version = version
+                    idle_ticks = 0
+                    
+                    # Clients watching the same job share one payload per
+                    # progress version; resyncs always go to the DB
+                    cached = await cache.aget(_progress_cache_key(job.id)) if version is not None and not resync else None
+                    if cached and cached[0] == version:
+                        progress_data, snapshot = cached[1], cached[2]
+                    else:
+                        progress_data, snapshot = await sync_to_async(_encode_job_progress)(job)
+                        if version is not None:
+                            await cache.aset(_progress_cache_key(job.id), (version, progress_data, snapshot), SSE_PAYLOAD_TIMEOUT)
+                    status = progress_data['job']['status']
+                    
+                    # Full snapshot first, then only what changed since the last frame.
+                    # Identical snapshot bytes mean nothing changed, so the diff is skipped
+                    frame = None
+                    if last_progress is None:
+                        frame = b"event: snapshot\ndata: " + snapshot + b"\n\n"
+                    elif snapshot != last_snapshot:
+                        delta = _progress_delta(last_progress, progress_data)
+                        if delta:
+                            frame = b"event: delta\ndata: " + orjson.dumps(delta) + b"\n\n"
+                    
+                    if frame:
+                        buffer += frame
+                        last_progress = progress_data
+                        last_snapshot = snapshot
+                        last_sent = time.monotonic()
+                        poll_interval = SSE_MIN_INTERVAL
+                    else:
+                        poll_interval = min(SSE_MAX_INTERVAL, poll_interval * SSE_BACKOFF)
+                    
+                    # Stop streaming if job is complete
+                    if status in ['COMPLETED', 'FAILED', 'CANCELLED']:
+                        buffer += b"event: complete\ndata: Job " + status.lower().encode() + b"\n\n"
+                        finished = True
+                else:
+                    idle_ticks += 1
+                    poll_interval = min(SSE_MAX_INTERVAL, poll_interval * SSE_BACKOFF)
                 
-                # Only send if data changed or job completed
-                current_update = json.dumps(progress_data, sort_keys=True)
-                if current_update != last_update or job.status in ['COMPLETED', 'FAILED']:
-                    yield f"data: {current_update}\n\n"
-                    last_update = current_update
-                
-                # Stop streaming if job is complete
-                if job.status in ['COMPLETED', 'FAILED', 'CANCELLED']:
-                    yield f"event: complete\ndata: Job {job.status.lower()}\n\n"
-                    break
-                
-                # Wait before next update
-                time.sleep(1)  # Update every second
+                # Keep proxies from closing a quiet connection
+                if not buffer and time.monotonic() - last_sent >= SSE_HEARTBEAT_SECONDS:
+                    buffer += b": heartbeat\n\n"
+                    last_sent = time.monotonic()
                 
             except Exception as e:
-                yield f"event: error\ndata: {str(e)}\n\n"
+                buffer += b"event: error\ndata: " + str(e).encode() + b"\n\n"
+                finished = True
+            
+            if buffer:
+                yield bytes(buffer)
+            if finished:
                 break
+            
+            # Wait before next update
+            await asyncio.sleep(poll_interval)
+    
+    # Progress frames repeat heavily, so compress the stream when the client allows it
+    gzip_stream = 'gzip' in request.headers.get('Accept-Encoding', '')
     
     response = StreamingHttpResponse(
-        event_stream(),
+        _gzip_stream(event_stream()) if gzip_stream else event_stream(),
         content_type='text/event-stream'
     )
+    if gzip_stream:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
     response['Cache-Control'] = 'no-cache'
     response['Connection'] = 'keep-alive'
     response['Access-Control-Allow-Origin'] = '*'
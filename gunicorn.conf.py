@@ -51,5 +51,11 @@ def post_fork(server, worker):
 def post_worker_init(worker):
     worker.log.info("Worker initialized (pid: %s)", worker.pid)
 
+def worker_exit(server, worker):
+    # Job threads are joined at interpreter exit, so ask them to pause now
+    from batch_downloader.services.simple_downloader import request_shutdown
+    request_shutdown()
+    worker.log.info("Worker exiting, pausing running jobs (pid: %s)", worker.pid)
+
 def worker_abort(worker):
     worker.log.info("Worker received SIGABRT signal")
\ No newline at end of file
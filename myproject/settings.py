@@ -172,6 +172,8 @@ HTTP_CONNECT_TIMEOUT = env.int('HTTP_CONNECT_TIMEOUT', 10)  # Increased for unst
 HTTP_READ_TIMEOUT = env.int('HTTP_READ_TIMEOUT', 60)  # Increased for large files
 HTTP_WRITE_TIMEOUT = env.int('HTTP_WRITE_TIMEOUT', 60)  # Increased for large files
 MAX_IMAGE_SIZE_MB = env.int('MAX_IMAGE_SIZE_MB', 100)  # Increased limit
+JOB_WORKERS = env.int('JOB_WORKERS', 4)  # Max jobs processed concurrently per web process
+DOWNLOAD_WORKERS = env.int('DOWNLOAD_WORKERS', 8)  # Parallel image downloads per product
 
 # Storage Configuration
 MEDIA_BACKEND = env.str('MEDIA_BACKEND', 'local')
@@ -179,6 +181,7 @@ MEDIA_BACKEND = env.str('MEDIA_BACKEND', 'local')
 # ZIP Creation Settings (Optimized for speed)
 ZIP_COMPRESSION_LEVEL = env.int('ZIP_COMPRESSION_LEVEL', 1)  # Fast compression for production
 MAX_ZIP_SIZE = env.int('MAX_ZIP_SIZE', 10737418240)  # 10GB limit
+ZIP_ACCEL_REDIRECT_PREFIX = env.str('ZIP_ACCEL_REDIRECT_PREFIX', '')  # nginx internal location aliasing MEDIA_ROOT; empty serves ZIPs from Django
 
 # Security Settings for Production (enable when using HTTPS)
 SECURE_SSL_REDIRECT = env.bool('SECURE_SSL_REDIRECT', False)